@@ -0,0 +1,165 @@
+import math
+import time
+import select
+import socket
+import threading
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised by a pipeline stage that starts, or is still running, after the request deadline.
+    """
+
+
+class RequestCancelled(Exception):
+    """
+    Raised by a pipeline stage once the client of the request has disconnected.
+    """
+
+
+
+class Deadline:
+    def __init__(self, timeout, start=None):
+        """
+        Deadline of a request, passed through every stage of the extraction pipeline (OCR, each LLM call, upsert)
+        so that stages skip or abort the work nobody will read. It can also be cancelled, e.g. on client disconnect.
+
+        Args:
+            timeout (float): Seconds from `start` until the deadline.
+            start (float): time.monotonic() at which the request arrived. Default is None, now.
+
+        Attributes:
+            start (float): time.monotonic() at which the request arrived.
+            expires_at (float): time.monotonic() of the deadline.
+        """
+        self.start = time.monotonic() if start is None else start
+        self.expires_at = self.start + timeout
+        self._cancelled = threading.Event()
+
+
+
+    @classmethod
+    def from_headers(cls, headers, default_timeout, max_timeout):
+        """
+        Build the deadline of a request.
+
+        The client may ask for a shorter timeout with the X-Request-Timeout header (seconds); values that are not
+        a finite positive number are ignored. When a proxy sets
+        X-Request-Start ("t=<epoch seconds, milliseconds or microseconds>"), the deadline counts from the time the
+        request reached the proxy, so time spent queued in front of the app is included.
+
+        Args:
+            headers (Mapping): Request headers.
+            default_timeout (float): Timeout in seconds when the client does not ask for one.
+            max_timeout (float): Upper bound of the timeout in seconds.
+
+        Returns:
+            Deadline: The request deadline.
+        """
+        try:
+            timeout = float(headers.get("X-Request-Timeout", default_timeout))
+        except ValueError:
+            timeout = default_timeout
+        # nan, inf, zero or negative timeouts would expire the request at once or never
+        if not math.isfinite(timeout) or timeout <= 0:
+            timeout = default_timeout
+        timeout = min(timeout, max_timeout)
+
+        start = None
+        request_start = headers.get("X-Request-Start")
+        if request_start:
+            try:
+                arrived = float(request_start.strip().removeprefix("t="))
+                # nginx sends seconds with a fraction, others milliseconds or microseconds
+                if arrived > 1e14:
+                    arrived /= 1e6
+                elif arrived > 1e11:
+                    arrived /= 1e3
+                start = time.monotonic() - max(0.0, time.time() - arrived)
+            except ValueError:
+                pass
+
+        return cls(timeout, start=start)
+
+
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left until the deadline, 0 once it has passed.
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def elapsed(self):
+        """
+        Returns:
+            float: Seconds since the request arrived.
+        """
+        return time.monotonic() - self.start
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+
+    def check(self, stage):
+        """
+        Abort the request if it was cancelled or its deadline has passed.
+
+        Args:
+            stage (str): Name of the stage about to run, used in the error message.
+
+        Raises:
+            RequestCancelled: If the request was cancelled.
+            DeadlineExceeded: If the deadline has passed.
+        """
+        if self.cancelled:
+            raise RequestCancelled(f"Request cancelled before {stage}")
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline exceeded before {stage} ({self.elapsed():.1f}s since arrival)")
+
+
+
+def watch_disconnect(environ, deadline, interval=0.5):
+    """
+    Cancel the deadline when the client closes its connection, by polling the request socket in a background thread.
+    Works with servers exposing the socket in the WSGI environ (Werkzeug's development server, gunicorn).
+
+    Args:
+        environ (dict): WSGI environ of the request.
+        deadline (Deadline): Deadline to cancel.
+        interval (float): Seconds between two polls. Default is 0.5.
+
+    Returns:
+        callable: Stops watching; call it once the request is handled.
+    """
+    sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+    stopped = threading.Event()
+    if sock is None:
+        return stopped.set
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            # a readable socket with nothing to read has been closed by the peer
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+
+    def watch():
+        while not stopped.wait(interval):
+            if disconnected():
+                print("Client disconnected, cancelling the request.")
+                deadline.cancel()
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
+    return stopped.set
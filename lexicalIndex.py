@@ -0,0 +1,149 @@
+import re
+import sqlite3
+import threading
+
+
+class LexicalIndex:
+    def __init__(self, db_path):
+        """
+        BM25 inverted index over the skills, technologies and inference text of the candidates, backed by SQLite FTS5.
+        Bare keyword queries ("Kubernetes Go Kafka") are answered from this index instead of the dense vector index.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+
+        Attributes:
+            db_path (str): Path to the SQLite database file.
+            column_weights (tuple): BM25 weights of the skills, technologies and inference columns.
+        """
+        self.db_path = db_path
+        self.column_weights = (3.0, 2.0, 1.0)
+        self._local = threading.local()
+
+        self._connection().execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS lexical_index USING fts5(
+                namespace UNINDEXED,
+                doc_id UNINDEXED,
+                skills,
+                technologies,
+                inference,
+                tokenize = "unicode61 tokenchars '+#.'"
+            )
+            """
+        )
+
+
+
+    def _connection(self):
+        """
+        Get the SQLite connection of the current thread.
+
+        Returns:
+            sqlite3.Connection: Connection in autocommit mode.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            # several worker processes write to the same index
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+
+
+    @staticmethod
+    def tokenize(text):
+        """
+        Split text into lowercase terms, keeping skill names such as "c++", "c#" and "node.js" whole.
+
+        Args:
+            text (str): The text to be tokenized.
+
+        Returns:
+            list: The terms of the text.
+        """
+        return re.findall(r"[\w][\w+#.]*[\w+#]|[\w]", (text or "").lower())
+
+
+
+    def upsert(self, namespace, doc_id, skills=(), technologies=(), inference=""):
+        """
+        Index (or re-index) a candidate.
+
+        Args:
+            namespace (str): Namespace of the candidate.
+            doc_id (str): ID of the candidate, the same as in ChromaDB.
+            skills (list): Extracted skills.
+            technologies (list): Extracted technologies.
+            inference (str): Inference text of the candidate.
+        """
+        fields = [" ".join(self.tokenize(" ".join(values))) for values in (skills, technologies)]
+        fields.append(" ".join(self.tokenize(inference)))
+
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "DELETE FROM lexical_index WHERE namespace = ? AND doc_id = ?", (namespace, doc_id)
+            )
+            connection.execute(
+                "INSERT INTO lexical_index (namespace, doc_id, skills, technologies, inference) VALUES (?, ?, ?, ?, ?)",
+                (namespace, doc_id, *fields),
+            )
+
+
+
+    def contains(self, namespace, doc_ids):
+        """
+        Check which candidates are already indexed.
+
+        Args:
+            namespace (str): Namespace of the candidates.
+            doc_ids (list): IDs of the candidates.
+
+        Returns:
+            set: The IDs that are indexed.
+        """
+        if not doc_ids:
+            return set()
+        placeholders = ", ".join("?" * len(doc_ids))
+        rows = self._connection().execute(
+            f"SELECT doc_id FROM lexical_index WHERE namespace = ? AND doc_id IN ({placeholders})",
+            (namespace, *doc_ids),
+        )
+        return {row[0] for row in rows}
+
+
+
+    def search(self, query, namespaces, top_k=10):
+        """
+        Rank the candidates matching any query term with BM25.
+
+        Args:
+            query (str): Keyword query.
+            namespaces (list): Namespaces to search.
+            top_k (int): Number of candidates to return. Default is 10.
+
+        Returns:
+            list: (namespace, doc_id, score) tuples, best first. Higher scores are better.
+        """
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms or not namespaces:
+            return []
+
+        match = " OR ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        placeholders = ", ".join("?" * len(namespaces))
+        weights = ", ".join(str(weight) for weight in self.column_weights)
+        rows = self._connection().execute(
+            f"""
+            SELECT namespace, doc_id, bm25(lexical_index, 0, 0, {weights}) AS rank
+            FROM lexical_index
+            WHERE lexical_index MATCH ? AND namespace IN ({placeholders})
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (match, *namespaces, top_k),
+        )
+        # FTS5 bm25() is negative, lower is better
+        return [(namespace, doc_id, -rank) for namespace, doc_id, rank in rows]
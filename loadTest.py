@@ -0,0 +1,359 @@
+"""
+Load test of the Flask API with stubbed LLM and OCR backends.
+
+Usage:
+    python loadTest.py --concurrency 1,2,4,8,16,32 --duration 30 --upload-ratio 0.2 --llm-latency 1.5 --ocr-latency 0.3
+    python loadTest.py --url http://127.0.0.1:5000 --concurrency 1,2,4,8
+
+Without --url, the harness starts `serve.py --app loadTestApp:app` on a free port and a fresh storage
+directory, so the server never shares a process (and its GIL) with the load generator. loadTestApp.py serves
+the app of main.py with the LLM calls and Tesseract OCR replaced by stubs sleeping for the latencies of
+LOADTEST_STUB_LATENCIES="<llm seconds>,<ocr seconds>"; everything else (PDF rasterization, embeddings,
+ChromaDB, the lexical index and the profile store) is the real code path. With --url, the server under test
+is started separately, e.g. serving loadTestApp.py to stub the backends. At every concurrency level, each client replays a
+random mix of /resume/upload and /documents/retrieve requests back to back. The report gives throughput,
+p50/p95/p99 latency and error rate per level and endpoint, and the saturation throughput: the best
+throughput reached before adding clients stops helping.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+
+SAMPLE_RESUME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resume", "resume_example.pdf")
+
+SAMPLE_QUERIES = [
+    "Kubernetes Go Kafka",
+    "Python machine learning PyTorch",
+    "The candidate has a strong background in software engineering and has worked on multiple projects using Python and Java.",
+    "Content marketing and data analysis",
+    "React TypeScript frontend",
+    "He is a skillful Spanish speaker",
+]
+
+SAMPLE_SKILLS = [
+    "Python", "Java", "Go", "Kafka", "Kubernetes", "Docker", "AWS", "React", "TypeScript", "SQL",
+    "PyTorch", "TensorFlow", "C++", "Rust", "Data Analysis", "Content Marketing", "Spanish", "Leadership",
+]
+
+# increase in throughput below which more clients no longer count as progress
+SATURATION_GAIN = 0.05
+
+# "<llm seconds>,<ocr seconds>[,<jitter>]", read by loadTestApp.py to stub the backends of the server under test
+STUB_LATENCIES_ENV = "LOADTEST_STUB_LATENCIES"
+
+
+
+def _sleep(latency, jitter):
+    time.sleep(max(0.0, random.gauss(latency, latency * jitter)))
+
+
+
+def install_stubs(utils, llm_latency, ocr_latency, jitter=0.2):
+    """
+    Replace the LLM calls and Tesseract OCR of utils by stubs with the given latencies.
+
+    Args:
+        utils (module): The utils module, already imported.
+        llm_latency (float): Mean latency in seconds of every LLM call.
+        ocr_latency (float): Mean latency in seconds of the OCR of one page.
+        jitter (float): Standard deviation of the latencies, relative to the mean. Default is 0.2.
+    """
+    def ocr_image(image_bytes, timeout=None):
+        _sleep(ocr_latency, jitter)
+        return "Stub resume text\n"
+
+    def llm(result):
+        def call(text, deadline=None):
+            if deadline is not None:
+                deadline.check("LLM call")
+            _sleep(llm_latency, jitter)
+            return json.dumps(result() if callable(result) else result)
+        return call
+
+    utils._ocr_image = ocr_image
+    utils.extract_personal_info = llm(lambda: {"name": f"Load Test {uuid.uuid4().hex[:12]}", "email": "", "awards": []})
+    utils.extract_education = llm([{"school": "Stub University", "degree": "BSc", "graduation_year": "2020"}])
+    utils.extract_work_experience = llm([{"company": "Stub Inc", "position": "Engineer", "skills involved": "Python, SQL"}])
+    utils.extract_projects_and_skills = llm(lambda: {
+        "Project Experience": [{"name": "Stub project", "technologies_used": ", ".join(random.sample(SAMPLE_SKILLS, 3))}],
+        "Skills": random.sample(SAMPLE_SKILLS, 5),
+    })
+    utils.generate_inference = llm(lambda: {
+        "inference": "The candidate is an engineer experienced in " + ", ".join(random.sample(SAMPLE_SKILLS, 4)) + "."
+    })
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(percentile / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """
+    Summarize request samples.
+
+    Args:
+        samples (list): (endpoint, latency in seconds, ok) tuples.
+        elapsed (float): Wall-clock duration of the run in seconds.
+
+    Returns:
+        dict: requests, throughput (req/s), error_rate and p50/p95/p99 latencies in milliseconds.
+    """
+    latencies = sorted(latency for _, latency, _ in samples)
+    errors = sum(1 for _, _, ok in samples if not ok)
+    summary = {
+        "requests": len(samples),
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "error_rate": errors / len(samples) if samples else 0.0,
+    }
+    for percentile in (50, 95, 99):
+        value = _percentile(latencies, percentile)
+        summary[f"p{percentile}_ms"] = None if value is None else value * 1000
+    return summary
+
+
+
+def run_level(client_factory, concurrency, duration, upload_ratio, pdf_bytes):
+    """
+    Run one concurrency level: every client sends requests back to back for `duration` seconds.
+
+    Args:
+        client_factory (callable): (pdf_bytes) -> send(endpoint) -> ok, builds the request function of one client.
+        concurrency (int): Number of concurrent clients.
+        duration (float): Duration of the level in seconds.
+        upload_ratio (float): Share of uploads in the request mix.
+        pdf_bytes (bytes): Resume uploaded by every upload request.
+
+    Returns:
+        dict: Summary of the level overall and per endpoint.
+    """
+    samples = []
+    samples_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        send = client_factory(pdf_bytes)
+        while time.monotonic() < deadline:
+            endpoint = "/resume/upload" if random.random() < upload_ratio else "/documents/retrieve"
+            start = time.monotonic()
+            ok = send(endpoint)
+            latency = time.monotonic() - start
+            with samples_lock:
+                samples.append((endpoint, latency, ok))
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # in-flight requests finish after the deadline and are counted
+    elapsed = time.monotonic() - start
+
+    return {
+        "concurrency": concurrency,
+        "overall": summarize(samples, elapsed),
+        "endpoints": {
+            endpoint: summarize([sample for sample in samples if sample[0] == endpoint], elapsed)
+            for endpoint in ("/resume/upload", "/documents/retrieve")
+        },
+    }
+
+
+
+def http_client_factory(base_url, timeout):
+    """
+    Build clients sending real HTTP requests to the server under test.
+
+    Args:
+        base_url (str): URL of the server, e.g. http://127.0.0.1:5000.
+        timeout (float): Request timeout in seconds.
+
+    Returns:
+        callable: (pdf_bytes) -> send(endpoint) -> ok.
+    """
+    import requests
+
+    def factory(pdf_bytes):
+        session = requests.Session()
+
+        def send(endpoint):
+            try:
+                if endpoint == "/resume/upload":
+                    response = session.post(
+                        base_url + endpoint,
+                        files={"file": ("resume.pdf", pdf_bytes, "application/pdf")},
+                        timeout=timeout,
+                    )
+                else:
+                    body = {"query": random.choice(SAMPLE_QUERIES), "mode": random.choice(["dense", "lexical", "hybrid"])}
+                    response = session.post(base_url + endpoint, json=body, timeout=timeout)
+                return response.status_code == 200
+            except requests.RequestException:
+                return False
+
+        return send
+
+    return factory
+
+
+
+def find_saturation(levels):
+    """
+    Find the level after which more clients no longer raise throughput by SATURATION_GAIN.
+
+    Args:
+        levels (list): Level summaries, by increasing concurrency.
+
+    Returns:
+        dict: The saturation level summary.
+    """
+    saturation = levels[0]
+    for level in levels[1:]:
+        if level["overall"]["throughput"] < saturation["overall"]["throughput"] * (1 + SATURATION_GAIN):
+            break
+        saturation = level
+    return saturation
+
+
+
+def print_report(report):
+    """
+    Print the report as a table.
+    """
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    print(f"\n{'clients':>8} {'endpoint':<20} {'req':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for level in report["levels"]:
+        rows = [("all", level["overall"])] + list(level["endpoints"].items())
+        for endpoint, summary in rows:
+            print(
+                f"{level['concurrency']:>8} {endpoint:<20} {summary['requests']:>7} {summary['throughput']:>8.2f} "
+                f"{fmt(summary['p50_ms'], '9.1f')} {fmt(summary['p95_ms'], '9.1f')} {fmt(summary['p99_ms'], '9.1f')} "
+                f"{summary['error_rate']:>7.1%}"
+            )
+    saturation = report["saturation"]
+    print(
+        f"\nSaturation: {saturation['overall']['throughput']:.2f} req/s at {saturation['concurrency']} clients, "
+        f"p99 {fmt(saturation['overall']['p99_ms'], '.1f')} ms, error rate {saturation['overall']['error_rate']:.1%}"
+    )
+
+
+
+def start_server(workers, port, llm_latency, ocr_latency, timeout):
+    """
+    Start serve.py with the stubbed app of loadTestApp.py on a fresh storage directory and wait until it answers.
+
+    Args:
+        workers (int): Number of worker processes.
+        port (int): Port to listen on, 0 for a free port.
+        llm_latency (float): Mean latency in seconds of every stubbed LLM call.
+        ocr_latency (float): Mean latency in seconds of the stubbed OCR of one page.
+        timeout (float): Seconds to wait for the server to answer.
+
+    Returns:
+        tuple: (subprocess.Popen of the supervisor, base URL of the server).
+    """
+    import requests
+
+    if not port:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+    # the app must not write into the real database
+    env = dict(
+        os.environ,
+        STORAGE_PATH=tempfile.mkdtemp(prefix="resume-loadtest-"),
+        **{STUB_LATENCIES_ENV: f"{llm_latency},{ocr_latency}"},
+    )
+    env.setdefault("OPENAI_API_KEY", "stub")
+    serve_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+    process = subprocess.Popen(
+        [sys.executable, serve_path, "--app", "loadTestApp:app", "--port", str(port), "--workers", str(workers), "--max-requests", "0"],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"Started serve.py on port {port} with {workers} workers, storage {env['STORAGE_PATH']}")
+
+    ready_by = time.monotonic() + timeout
+    while time.monotonic() < ready_by:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with code {process.returncode}")
+        try:
+            # any answer, even a 404, means a worker is serving
+            requests.get(base_url + "/debug/memory", timeout=timeout)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"serve.py did not answer within {timeout}s")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the resume API with stubbed LLM and OCR backends.")
+    parser.add_argument("--url", help="URL of a running server to test, e.g. http://127.0.0.1:5000. Default is to start serve.py.")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Comma-separated client counts. Default is 1,2,4,8,16,32.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per concurrency level. Default is 30.")
+    parser.add_argument("--upload-ratio", type=float, default=0.2, help="Share of uploads in the mix. Default is 0.2.")
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="Seconds per stubbed LLM call. Default is 1.5.")
+    parser.add_argument("--ocr-latency", type=float, default=0.3, help="Seconds per stubbed OCR page. Default is 0.3.")
+    parser.add_argument("--seed-uploads", type=int, default=20, help="Resumes uploaded before the first level. Default is 20.")
+    parser.add_argument("--timeout", type=float, default=60, help="Request timeout in seconds. Default is 60.")
+    # several workers need a Chroma server, see serve.py
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the started server, more than 1 needs CHROMA_SERVER_URL. Default is 1.")
+    parser.add_argument("--port", type=int, default=0, help="Port of the started server. Default is a free port.")
+    parser.add_argument("--report", help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    server, base_url = (None, args.url.rstrip("/")) if args.url else start_server(
+        args.workers, args.port, args.llm_latency, args.ocr_latency, args.timeout
+    )
+    factory = http_client_factory(base_url, args.timeout)
+
+    with open(SAMPLE_RESUME_PATH, "rb") as f:
+        pdf_bytes = f.read()
+
+    try:
+        print(f"Load testing {base_url}")
+        seed = factory(pdf_bytes)
+        for _ in range(args.seed_uploads):
+            seed("/resume/upload")
+
+        levels = []
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            print(f"Running {concurrency} clients for {args.duration:g}s...")
+            levels.append(run_level(factory, concurrency, args.duration, args.upload_ratio, pdf_bytes))
+    finally:
+        if server is not None:
+            # SIGTERM drains the workers
+            server.terminate()
+            server.wait()
+
+    report = {
+        "config": vars(args),
+        "levels": levels,
+        "saturation": find_saturation(levels),
+    }
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
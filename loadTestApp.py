@@ -0,0 +1,19 @@
+"""
+The app of main.py with the LLM calls and Tesseract OCR replaced by stubs, for load tests only.
+
+Usage:
+    LOADTEST_STUB_LATENCIES=1.5,0.3 STORAGE_PATH=/tmp/loadtest python serve.py --app loadTestApp:app
+
+LOADTEST_STUB_LATENCIES is "<llm seconds>,<ocr seconds>[,<jitter>]", 1.5,0.3 by default. Never serve this
+module on a real STORAGE_PATH: every upload stores a fake candidate. See loadTest.py.
+"""
+import os
+
+import utils
+from main import app  # noqa: F401, served by `serve.py --app loadTestApp:app`
+from loadTest import STUB_LATENCIES_ENV, install_stubs
+
+
+latencies = os.environ.get(STUB_LATENCIES_ENV, "1.5,0.3")
+install_stubs(utils, *[float(latency) for latency in latencies.split(",")])
+print(f"Process {os.getpid()} serving with stubbed LLM and OCR latencies {latencies}.")
@@ -9,15 +9,51 @@ if __name__ == "__main__":
     except RuntimeError:
         pass
 
+import os
+import threading
+from io import BytesIO
 from flasgger import Swagger
-from flask import Flask, jsonify, request
-from utils import extract_and_infer, retrieve_top_documents
+from flask import Flask, Request, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+from utils import InvalidPDFError, UploadsPaused, extract_and_infer, retrieve_top_documents, normalize_namespace
+from deadline import Deadline, DeadlineExceeded, RequestCancelled, watch_disconnect
+from memoryMonitor import MEMORY_DEBUG, PeakRSSTracker, memory_report, start_tracing
 from vectorStore import VectorStore
 
 
 
+class InMemoryRequest(Request):
+    """
+    Request that keeps uploaded files in memory; Werkzeug spools files larger than 500 KB to a temporary file.
+    MAX_CONTENT_LENGTH bounds the size, and is enforced while the body is streamed in.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return BytesIO()
+
+
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
 swagger = Swagger(app)
+start_tracing()
+
+# uploads are bounded by a deadline (seconds since arrival) and by the number processed at once;
+# an upload that cannot start before its deadline is shed with a 503
+UPLOAD_DEADLINE_SECONDS = float(os.environ.get("UPLOAD_DEADLINE_SECONDS", 120))
+MAX_UPLOAD_DEADLINE_SECONDS = float(os.environ.get("MAX_UPLOAD_DEADLINE_SECONDS", 300))
+upload_slots = threading.BoundedSemaphore(int(os.environ.get("MAX_CONCURRENT_UPLOADS", 4)))
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({"error": f"Upload exceeds the limit of {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+
+def _overloaded(deadline):
+    response = jsonify({"error": f"Server overloaded: request queued for {deadline.elapsed():.1f}s, past its deadline"})
+    response.headers["Retry-After"] = "5"
+    return response, 503
 
 @app.route("/")
 def index():
@@ -43,7 +79,25 @@ def process_resume():
         name: file
         type: file
         required: true
+      - in: formData
+        name: namespace
+        type: string
+        required: false
+        description: Namespace (tenant, region or hiring pipeline) the candidate is stored in
+      - in: header
+        name: X-Request-Timeout
+        type: number
+        required: false
+        description: Seconds after which the client gives up (default UPLOAD_DEADLINE_SECONDS)
     responses:
+      400:
+        description: No file, invalid namespace, or the file is not a valid PDF
+      503:
+        description: Overloaded, the upload could not start before its deadline, or uploads to the namespace are paused
+      504:
+        description: The deadline passed during processing
+      413:
+        description: The upload exceeds MAX_UPLOAD_BYTES
       200:
         description: Inference of the resume
         schema:
@@ -56,6 +110,11 @@ def process_resume():
               type: object
               description: The inference based on the extracted info of the resume
     """
+    deadline = Deadline.from_headers(request.headers, UPLOAD_DEADLINE_SECONDS, MAX_UPLOAD_DEADLINE_SECONDS)
+    if deadline.expired:
+        # already queued in front of the app for longer than the client waits
+        return _overloaded(deadline)
+
     if "file" not in request.files:
         return jsonify({"error": "No file part"}), 400
 
@@ -64,13 +123,40 @@ def process_resume():
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
 
+    try:
+        namespace = normalize_namespace(request.form.get("namespace"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     if file:
-        #save the uploaded resume to a default location
-        file_path = "./resume/resume_example.pdf"
-        file.save(file_path) 
+        # the upload is already in memory, see InMemoryRequest
+        pdf_bytes = file.read()
+        # the header may follow some junk, anywhere in the first 1024 bytes
+        if b"%PDF-" not in pdf_bytes[:1024]:
+            return jsonify({"error": "The uploaded file is not a PDF"}), 400
         
-        #extract and infer information from the uploaded resume
-        extracted_info, summary = extract_and_infer(file_path)
+        if not upload_slots.acquire(timeout=deadline.remaining()):
+            return _overloaded(deadline)
+        stop_watching = watch_disconnect(request.environ, deadline)
+        try:
+            #extract and infer information from the uploaded resume
+            with PeakRSSTracker("extract_and_infer"):
+                extracted_info, summary = extract_and_infer(pdf_bytes, namespace=namespace, deadline=deadline)
+        except InvalidPDFError as e:
+            return jsonify({"error": str(e)}), 400
+        except UploadsPaused as e:
+            # the namespace is being swapped to a re-indexed collection, see reindex.py
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = "5"
+            return response, 503
+        except DeadlineExceeded as e:
+            return jsonify({"error": str(e)}), 504
+        except RequestCancelled as e:
+            # the client is gone, nobody reads this response
+            return jsonify({"error": str(e)}), 499
+        finally:
+            stop_watching()
+            upload_slots.release()
         
         response = {
             "extracted_info": extracted_info,
@@ -96,6 +182,19 @@ def retrieve_documents():
             query:
               type: string
               description: The query text
+            namespace:
+              type: string
+              description: Only search the shard of this namespace
+            namespaces:
+              type: array
+              items:
+                type: string
+              description: Search these namespaces in parallel. Every namespace is searched when neither field is given
+            mode:
+              type: string
+              enum: [dense, lexical, hybrid]
+              default: dense
+              description: dense (embeddings), lexical (BM25 over skills, technologies and inference, for keyword queries) or hybrid (both fused with reciprocal rank fusion)
     responses:
       200:
         description: Top documents that best fit the query
@@ -103,16 +202,49 @@ def retrieve_documents():
           id: TopDocuments
           properties:
             documents:
-              type: array
-              items:
-                type: object
-                properties:
-                  score:
-                    type: number
-                    description: Similarity score
-                  extracted_info:
-                    type: object
-                    description: Extracted information of the document
+              type: object
+              description: Matches as parallel lists (one inner list per query), best first
+              properties:
+                ids:
+                  type: array
+                  items:
+                    type: array
+                    items:
+                      type: string
+                distances:
+                  type: array
+                  description: Cosine distance of every match (dense mode)
+                  items:
+                    type: array
+                    items:
+                      type: number
+                scores:
+                  type: array
+                  description: Relevance score of every match, higher is better (lexical and hybrid modes)
+                  items:
+                    type: array
+                    items:
+                      type: number
+                documents:
+                  type: array
+                  description: Inference text of every match
+                  items:
+                    type: array
+                    items:
+                      type: string
+                namespaces:
+                  type: array
+                  items:
+                    type: array
+                    items:
+                      type: string
+                profiles:
+                  type: array
+                  description: Stored profile of every match (extracted_info, inference, metadata), null if unknown
+                  items:
+                    type: array
+                    items:
+                      type: object
     """
     data = request.get_json()
     
@@ -122,13 +254,65 @@ def retrieve_documents():
     if not query:
         return jsonify({"error": "Query is required"}), 400
 
+    namespaces = data.get("namespaces") or data.get("namespace")
+    if namespaces is not None and not (
+        isinstance(namespaces, str)
+        or (isinstance(namespaces, list) and all(isinstance(namespace, str) for namespace in namespaces))
+    ):
+        return jsonify({"error": "namespace must be a string and namespaces a list of strings"}), 400
+    mode = data.get("mode", "dense")
+
     # Retrieve the top documents that best fit the query
-    top_matches = retrieve_top_documents(query = query, top_k= 10)
+    try:
+        top_matches = retrieve_top_documents(query = query, top_k= 10, namespaces=namespaces, mode=mode)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     response = {
         "documents": top_matches
     }
     return jsonify(response), 200
 
+@app.route("/debug/memory", methods=["GET"])
+def debug_memory():
+    """
+    Memory report of the worker process handling the request (only with MEMORY_DEBUG=1)
+    ---
+    parameters:
+      - in: query
+        name: top
+        type: integer
+        required: false
+        description: Number of allocation sites to report (default 20)
+      - in: query
+        name: key
+        type: string
+        enum: [lineno, filename, traceback]
+        required: false
+        description: How allocations are grouped (default lineno)
+      - in: query
+        name: compare
+        type: boolean
+        required: false
+        description: Report the allocation growth since the previous report of this worker
+    responses:
+      200:
+        description: RSS, peak RSS of the recent extract_and_infer calls and tracemalloc top allocations
+      404:
+        description: MEMORY_DEBUG is not enabled
+    """
+    if not MEMORY_DEBUG:
+        return jsonify({"error": "Memory debugging is disabled, set MEMORY_DEBUG=1"}), 404
+
+    key_type = request.args.get("key", "lineno")
+    if key_type not in ("lineno", "filename", "traceback"):
+        return jsonify({"error": "key must be lineno, filename or traceback"}), 400
+    report = memory_report(
+        top=request.args.get("top", 20, type=int),
+        key_type=key_type,
+        compare=request.args.get("compare", "false").lower() in ("1", "true"),
+    )
+    return jsonify(report), 200
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import resource
+import threading
+import tracemalloc
+from collections import deque
+
+import psutil
+from werkzeug.wsgi import ClosingIterator
+
+
+# opt-in: tracemalloc slows allocations down noticeably
+MEMORY_DEBUG = os.environ.get("MEMORY_DEBUG", "0") == "1"
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", 1))
+
+_process = psutil.Process()
+_previous_snapshot = None
+_snapshot_lock = threading.Lock()
+
+# peak RSS of the most recent tracked sections, newest last
+recent_peaks = deque(maxlen=100)
+
+
+
+def rss_bytes():
+    """
+    Returns:
+        int: Current resident set size of this process.
+    """
+    return _process.memory_info().rss
+
+
+def max_rss_bytes():
+    """
+    Returns:
+        int: Highest resident set size this process ever reached.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+
+def start_tracing():
+    """
+    Start tracemalloc if MEMORY_DEBUG is enabled.
+    """
+    if MEMORY_DEBUG and not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+        print(f"tracemalloc started ({MEMORY_TRACE_FRAMES} frames).")
+
+
+
+class PeakRSSTracker:
+    def __init__(self, label, interval=0.05):
+        """
+        Track the peak RSS of the process while a section runs, by sampling it from a background thread.
+        Other requests handled concurrently by the same process are included in the measure.
+
+        Args:
+            label (str): Name of the tracked section.
+            interval (float): Seconds between two samples. Default is 0.05.
+
+        Attributes:
+            label (str): Name of the tracked section.
+            start_rss (int): RSS when the section started.
+            peak_rss (int): Highest RSS sampled during the section.
+            end_rss (int): RSS when the section ended.
+            duration (float): Duration of the section in seconds.
+        """
+        self.label = label
+        self.interval = interval
+        self.start_rss = self.peak_rss = self.end_rss = 0
+        self.duration = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        self.start_rss = self.peak_rss = rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stopped.set()
+        self._thread.join()
+        self.end_rss = rss_bytes()
+        self.peak_rss = max(self.peak_rss, self.end_rss)
+        self.duration = time.monotonic() - self._start
+        recent_peaks.append(self.as_dict())
+        print(
+            f"{self.label}: peak RSS {self.peak_rss / 2**20:.1f} MB "
+            f"(+{(self.peak_rss - self.start_rss) / 2**20:.1f} MB), retained {(self.end_rss - self.start_rss) / 2**20:+.1f} MB"
+        )
+        return False
+
+    def as_dict(self):
+        return {
+            "label": self.label,
+            "start_rss_mb": self.start_rss / 2**20,
+            "peak_rss_mb": self.peak_rss / 2**20,
+            "end_rss_mb": self.end_rss / 2**20,
+            "duration_s": self.duration,
+        }
+
+
+
+def allocation_report(top=20, key_type="lineno", compare=False):
+    """
+    Report the top allocation sites from a tracemalloc snapshot.
+
+    Args:
+        top (int): Number of allocation sites to report. Default is 20.
+        key_type (str): "lineno", "filename" or "traceback". Default is "lineno".
+        compare (bool): Report the growth since the previous snapshot instead of the totals. Default is False.
+
+    Returns:
+        list: Allocation sites, largest first, or None if tracemalloc is not tracing.
+    """
+    global _previous_snapshot
+    if not tracemalloc.is_tracing():
+        return None
+
+    with _snapshot_lock:
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if compare and _previous_snapshot is not None:
+            stats = snapshot.compare_to(_previous_snapshot, key_type)
+        else:
+            stats = snapshot.statistics(key_type)
+        _previous_snapshot = snapshot
+
+    return [
+        {
+            "trace": [str(frame) for frame in stat.traceback.format()] if key_type == "traceback" else str(stat.traceback),
+            "size_kb": stat.size / 1024,
+            "count": stat.count,
+            **({"size_diff_kb": stat.size_diff / 1024, "count_diff": stat.count_diff} if hasattr(stat, "size_diff") else {}),
+        }
+        for stat in stats[:top]
+    ]
+
+
+
+def memory_report(top=20, key_type="lineno", compare=False):
+    """
+    Report the memory of this worker process: RSS, recent per-request peaks and, when tracing, top allocations.
+
+    Args:
+        top (int): Number of allocation sites to report. Default is 20.
+        key_type (str): "lineno", "filename" or "traceback". Default is "lineno".
+        compare (bool): Report allocation growth since the previous report. Default is False.
+
+    Returns:
+        dict: The report.
+    """
+    report = {
+        "pid": os.getpid(),
+        "rss_mb": rss_bytes() / 2**20,
+        "max_rss_mb": max_rss_bytes() / 2**20,
+        "recent_peaks": list(recent_peaks),
+        "tracing": tracemalloc.is_tracing(),
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced_mb"] = current / 2**20
+        report["traced_peak_mb"] = peak / 2**20
+        report["top_allocations"] = allocation_report(top, key_type, compare)
+    return report
+
+
+
+class WorkerRecycler:
+    def __init__(self, app, max_requests=0, rss_limit_bytes=0, on_recycle=None):
+        """
+        WSGI middleware asking for the worker to be recycled once it has served `max_requests` requests or its RSS
+        passed `rss_limit_bytes`. Once recycling, responses carry "Connection: close" so clients do not reuse
+        their connection to the worker.
+
+        Args:
+            app (callable): WSGI application.
+            max_requests (int): Requests after which to recycle, 0 for no limit. Default is 0.
+            rss_limit_bytes (int): RSS after which to recycle, 0 for no limit. Default is 0.
+            on_recycle (callable): Called once, with the reason, when the worker should stop accepting requests.
+
+        Attributes:
+            served (int): Requests completed.
+            recycle_reason (str): Why recycling was requested, None until then.
+        """
+        self.app = app
+        self.max_requests = max_requests
+        self.rss_limit_bytes = rss_limit_bytes
+        self.on_recycle = on_recycle
+        self.served = 0
+        self.recycle_reason = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        def close_when_recycling(status, headers, exc_info=None):
+            if self.recycle_reason is not None:
+                headers = [header for header in headers if header[0].lower() != "connection"] + [("Connection", "close")]
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self.app(environ, close_when_recycling)
+        except BaseException:
+            self._finished()
+            raise
+        # the request is only done once the response body has been sent
+        return ClosingIterator(app_iter, self._finished)
+
+    def _finished(self):
+        with self._lock:
+            self.served += 1
+            served = self.served
+
+        reason = None
+        if self.max_requests and served >= self.max_requests:
+            reason = f"served {served} requests"
+        elif self.rss_limit_bytes:
+            rss = rss_bytes()
+            if rss > self.rss_limit_bytes:
+                reason = f"RSS {rss / 2**20:.0f} MB above {self.rss_limit_bytes / 2**20:.0f} MB"
+        if reason:
+            self.recycle(reason)
+
+    def recycle(self, reason):
+        """
+        Ask for the worker to be recycled; only the first call has an effect.
+
+        Args:
+            reason (str): Why the worker is recycled.
+        """
+        with self._lock:
+            if self.recycle_reason is not None:
+                return
+            self.recycle_reason = reason
+        print(f"Worker {os.getpid()} recycling: {reason}.")
+        if tracemalloc.is_tracing():
+            for allocation in allocation_report(top=10):
+                print(f"  {allocation['size_kb']:.0f} KB in {allocation['count']} blocks: {allocation['trace']}")
+        if self.on_recycle is not None:
+            self.on_recycle(reason)
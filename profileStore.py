@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class ProfileStore:
+    def __init__(self, db_path):
+        """
+        Persistent store of the full candidate profiles (extracted info, inference and metadata), keyed by
+        namespace and candidate ID. ChromaDB only keeps the inference text, so retrieval reads the structured
+        profiles of its matches from here instead of re-processing the resumes.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+
+        Attributes:
+            db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+
+        # the (namespace, candidate_id) primary key is the lookup index of retrieval
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS profiles (
+                namespace TEXT NOT NULL,
+                candidate_id TEXT NOT NULL,
+                extracted_info TEXT NOT NULL,
+                inference TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (namespace, candidate_id)
+            ) WITHOUT ROWID
+            """
+        )
+
+
+
+    def _connection(self):
+        """
+        Get the SQLite connection of the current thread.
+
+        Returns:
+            sqlite3.Connection: Connection in autocommit mode.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            # several worker processes write to the same store
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+
+
+    def upsert(self, namespace, candidate_id, extracted_info, inference, metadata=None):
+        """
+        Insert or replace the profile of a candidate.
+
+        Args:
+            namespace (str): Namespace of the candidate.
+            candidate_id (str): ID of the candidate, the same as in ChromaDB.
+            extracted_info (dict): Extracted information of the resume.
+            inference (dict): Inference about the candidate.
+            metadata (dict): Metadata stored alongside the vector. Default is None.
+        """
+        self._connection().execute(
+            """
+            INSERT OR REPLACE INTO profiles (namespace, candidate_id, extracted_info, inference, metadata, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                namespace,
+                candidate_id,
+                json.dumps(extracted_info),
+                json.dumps(inference),
+                json.dumps(metadata or {}),
+                datetime.now().isoformat(),
+            ),
+        )
+
+
+
+    def get_many(self, keys):
+        """
+        Fetch several profiles in a single query.
+
+        Args:
+            keys (list): (namespace, candidate_id) tuples.
+
+        Returns:
+            dict: (namespace, candidate_id) -> profile dict, only for the candidates that have a profile.
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        values = ", ".join("(?, ?)" for _ in keys)
+        rows = self._connection().execute(
+            # CROSS JOIN keeps the keys as the outer loop, so every key is a primary key lookup
+            f"""
+            WITH keys (namespace, candidate_id) AS (VALUES {values})
+            SELECT p.namespace, p.candidate_id, p.extracted_info, p.inference, p.metadata, p.updated_at
+            FROM keys CROSS JOIN profiles AS p
+                ON p.namespace = keys.namespace AND p.candidate_id = keys.candidate_id
+            """,
+            [value for key in keys for value in key],
+        )
+        return {
+            (namespace, candidate_id): {
+                "extracted_info": json.loads(extracted_info),
+                "inference": json.loads(inference),
+                "metadata": json.loads(metadata),
+                "updated_at": updated_at,
+            }
+            for namespace, candidate_id, extracted_info, inference, metadata, updated_at in rows
+        }
@@ -0,0 +1,139 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        """
+        Thread-safe bounded cache evicting the least recently used entry.
+
+        Args:
+            maxsize (int): Maximum number of entries. 0 disables the cache.
+
+        Attributes:
+            maxsize (int): Maximum number of entries.
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+
+    def get(self, key):
+        """
+        Get a cached value and mark it as recently used.
+
+        Args:
+            key (hashable): Cache key.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry when full.
+
+        Args:
+            key (hashable): Cache key.
+            value: Value to cache, must not be None.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+
+
+
+class WriteGenerations:
+    def __init__(self, db_path):
+        """
+        Per-namespace write generation counters, shared by all worker processes through SQLite.
+        Every write to a namespace bumps its generation, so cached results computed at an older
+        generation are recognized as stale.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+
+        Attributes:
+            db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL) WITHOUT ROWID"
+        )
+
+
+
+    def _connection(self):
+        """
+        Get the SQLite connection of the current thread.
+
+        Returns:
+            sqlite3.Connection: Connection in autocommit mode.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+
+
+    def bump(self, namespace):
+        """
+        Record a write to a namespace.
+
+        Args:
+            namespace (str): Namespace that was written to.
+        """
+        self._connection().execute(
+            """
+            INSERT INTO generations (namespace, generation) VALUES (?, 1)
+            ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1
+            """,
+            (namespace,),
+        )
+
+
+
+    def current(self, namespaces):
+        """
+        Get the current generations of namespaces.
+
+        Args:
+            namespaces (list): Namespaces.
+
+        Returns:
+            tuple: One generation per namespace, in the same order; 0 for never written namespaces.
+        """
+        placeholders = ", ".join("?" * len(namespaces))
+        rows = dict(self._connection().execute(
+            f"SELECT namespace, generation FROM generations WHERE namespace IN ({placeholders})", namespaces
+        ))
+        return tuple(rows.get(namespace, 0) for namespace in namespaces)
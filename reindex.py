@@ -0,0 +1,290 @@
+"""
+Re-embed and re-index a namespace shard with another embedding model.
+
+Usage:
+    python reindex.py --namespace test --model all-MiniLM-L6-v2
+
+Documents are streamed out of the current shard collection in pages, embedded in large batches
+by a pool of worker processes and written into a new collection. Progress is checkpointed after
+every page in chroma_db/reindex-<namespace>.json, so running the same command again after a crash
+resumes where it stopped. Once every document is copied, a catch-up pass re-embeds documents that
+were added or changed in the meantime. Then uploads to the namespace are paused (they answer 503), a final
+catch-up copies the last ones and the namespace is swapped atomically to the new collection, which resumes
+the uploads. The new collection is only written by this script before the swap: with a local Chroma
+PersistentClient, the service never sees the writes another process makes to a collection it has open.
+"""
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from multiprocessing import get_context
+
+from chromadb.utils import embedding_functions
+
+
+# worker process state, see _init_worker
+_worker_embedding_function = None
+
+
+def _init_worker(model_name):
+    """
+    Load the embedding model once per worker process.
+
+    Args:
+        model_name (str): Name of the sentence-transformers model.
+    """
+    global _worker_embedding_function
+    _worker_embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+
+
+def _embed_batch(texts):
+    """
+    Embed a batch of documents in a worker process.
+
+    Args:
+        texts (list): Documents to embed.
+
+    Returns:
+        list: One embedding per document.
+    """
+    return _worker_embedding_function(texts)
+
+
+
+def _load_checkpoint(checkpoint_path):
+    """
+    Load the checkpoint of an interrupted re-index.
+
+    Args:
+        checkpoint_path (str): Path to the checkpoint file.
+
+    Returns:
+        dict: The checkpoint, or None if there is none.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    """
+    Write the checkpoint atomically so a crash never leaves a truncated file behind.
+
+    Args:
+        checkpoint_path (str): Path to the checkpoint file.
+        checkpoint (dict): The checkpoint.
+    """
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+
+def _iter_pages(collection, offset, page_size):
+    """
+    Stream the documents of a collection page by page.
+
+    Args:
+        collection (chromadb.Collection): Collection to read.
+        offset (int): Offset of the first page.
+        page_size (int): Number of documents per page.
+
+    Yields:
+        tuple: (offset of the page, Chroma get result with ids, documents and metadatas).
+    """
+    while True:
+        page = collection.get(offset=offset, limit=page_size, include=["documents", "metadatas"])
+        if not page["ids"]:
+            return
+        yield offset, page
+        offset += len(page["ids"])
+
+
+
+def _embed_and_upsert(pool, target, ids, documents, metadatas, batch_size):
+    """
+    Embed documents across the worker pool and upsert them into the target collection.
+
+    Args:
+        pool (multiprocessing.Pool): Embedding worker pool.
+        target (chromadb.Collection): Collection to write into.
+        ids (list): Document IDs.
+        documents (list): Documents.
+        metadatas (list): Metadata of the documents.
+        batch_size (int): Number of documents embedded per worker task.
+    """
+    if not ids:
+        return
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    embeddings = [embedding for batch in pool.map(_embed_batch, batches) for embedding in batch]
+    target.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+
+
+def _catch_up(pool, source, target, offset, page_size, batch_size, on_page=None):
+    """
+    Re-embed the documents of `source` that are missing from `target` or differ from their copy.
+
+    Args:
+        pool (multiprocessing.Pool): Embedding worker pool.
+        source (chromadb.Collection): Collection to read.
+        target (chromadb.Collection): Collection to write into.
+        offset (int): Offset of the first page of `source`.
+        page_size (int): Number of documents read per page.
+        batch_size (int): Number of documents embedded per worker task.
+        on_page (callable): Called with the offset following every page, e.g. to checkpoint. Default is None.
+
+    Returns:
+        int: Number of documents re-embedded.
+    """
+    caught_up = 0
+    for offset, page in _iter_pages(source, offset, page_size):
+        copied = target.get(ids=page["ids"], include=["documents", "metadatas"])
+        copied = dict(zip(copied["ids"], zip(copied["documents"], copied["metadatas"])))
+        changed = [
+            i for i, doc_id in enumerate(page["ids"])
+            if copied.get(doc_id) != (page["documents"][i], page["metadatas"][i])
+        ]
+        _embed_and_upsert(
+            pool,
+            target,
+            [page["ids"][i] for i in changed],
+            [page["documents"][i] for i in changed],
+            [page["metadatas"][i] for i in changed],
+            batch_size,
+        )
+        caught_up += len(changed)
+        if on_page is not None:
+            on_page(offset + len(page["ids"]))
+    return caught_up
+
+
+
+def reindex_namespace(namespace, model_name, page_size=1024, batch_size=128, workers=4, restart=False, delete_old=False, settle_seconds=5):
+    """
+    Re-embed every document of a namespace shard with another model and swap the namespace to the new collection.
+
+    Uploads keep writing to the old collection while it is copied. Before the swap they are paused, and
+    `settle_seconds` later, once the uploads that passed the check have been stored, a final catch-up copies
+    whatever the new collection is missing. The swap then resumes the uploads, into the new collection.
+    If the run is interrupted while uploads are paused, they stay paused until it is resumed, or until
+    `utils.pause_uploads(namespace, False)`.
+
+    Args:
+        namespace (str): Namespace of the shard to re-index.
+        model_name (str): Name of the sentence-transformers model to embed with.
+        page_size (int): Number of documents read from the source collection per page. Default is 1024.
+        batch_size (int): Number of documents embedded per worker task. Default is 128.
+        workers (int): Number of embedding worker processes. Default is 4.
+        restart (bool): Discard the checkpoint of an interrupted run and start over. Default is False.
+        delete_old (bool): Delete the previous collection after the swap. Default is False.
+        settle_seconds (float): Seconds between pausing the uploads and the final catch-up. Default is 5.
+
+    Returns:
+        str: Name of the collection now serving the namespace.
+    """
+    # imported here so spawned workers do not load the service models
+    import utils
+
+    namespace = utils.normalize_namespace(namespace)
+    current = utils.get_shard(namespace)
+    if current is None:
+        raise ValueError(f"Namespace {namespace} does not exist.")
+
+    checkpoint_path = os.path.join(utils.storage_path, f"reindex-{namespace}.json")
+    checkpoint = None if restart else _load_checkpoint(checkpoint_path)
+    if checkpoint and (current.name not in (checkpoint["source"], checkpoint["target"]) or checkpoint["model"] != model_name):
+        raise ValueError(
+            f"An interrupted re-index of {namespace} from {checkpoint['source']} with {checkpoint['model']} exists, "
+            "pass --restart to discard it."
+        )
+    if checkpoint is None:
+        checkpoint = {
+            "namespace": namespace,
+            "source": current.name,
+            "target": f"{namespace[:40]}-v{datetime.now().strftime('%Y%m%d%H%M%S')}",
+            "model": model_name,
+            "phase": "copy",
+            "offset": 0,
+        }
+        _save_checkpoint(checkpoint_path, checkpoint)
+    else:
+        print(f"Resuming re-index of {namespace} at {checkpoint['phase']} offset {checkpoint['offset']}.")
+
+    source = current if current.name == checkpoint["source"] else utils._open_collection(checkpoint["source"])
+    target = utils.client.get_or_create_collection(
+        name=checkpoint["target"],
+        metadata={"hnsw:space": "cosine", "embedding_model": model_name},
+        embedding_function=utils.get_embedding_function(model_name),
+    )
+
+    def save_offset(offset):
+        checkpoint["offset"] = offset
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    with get_context("spawn").Pool(processes=workers, initializer=_init_worker, initargs=(model_name,)) as pool:
+        if checkpoint["phase"] == "copy":
+            for offset, page in _iter_pages(source, checkpoint["offset"], page_size):
+                _embed_and_upsert(pool, target, page["ids"], page["documents"], page["metadatas"], batch_size)
+                save_offset(offset + len(page["ids"]))
+                print(f"Copied {checkpoint['offset']} documents into {target.name}.")
+            checkpoint.update(phase="catchup", offset=0)
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+        if checkpoint["phase"] == "catchup":
+            # uploads keep writing to the source while we copy: re-embed whatever changed since
+            caught_up = _catch_up(pool, source, target, checkpoint["offset"], page_size, batch_size, save_offset)
+            print(f"Caught up {caught_up} changed documents.")
+            checkpoint.update(phase="final", offset=0)
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+        # once swapped, the service writes to the target: the final catch-up already ran
+        if current.name != target.name:
+            utils.pause_uploads(namespace)
+            # let the uploads that passed the pause check reach the source
+            time.sleep(settle_seconds)
+            caught_up = _catch_up(pool, source, target, 0, page_size, batch_size)
+            print(f"Final catch-up copied {caught_up} documents uploaded since the catch-up.")
+            # resumes the uploads and invalidates the cached results of the namespace
+            utils.swap_shard(namespace, target.name)
+
+    os.remove(checkpoint_path)
+
+    if delete_old and source.name != target.name:
+        utils.client.delete_collection(source.name)
+        print(f"Deleted previous collection {source.name}.")
+
+    print(f"Re-index of {namespace} with {model_name} finished: {target.count()} documents in {target.name}.")
+    return target.name
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed a namespace shard with another embedding model.")
+    parser.add_argument("--namespace", default="test", help="Namespace to re-index. Default is test.")
+    parser.add_argument("--model", required=True, help="sentence-transformers model, e.g. all-MiniLM-L6-v2.")
+    parser.add_argument("--page-size", type=int, default=1024, help="Documents read per page. Default is 1024.")
+    parser.add_argument("--batch-size", type=int, default=128, help="Documents embedded per worker task. Default is 128.")
+    parser.add_argument("--workers", type=int, default=4, help="Embedding worker processes. Default is 4.")
+    parser.add_argument("--restart", action="store_true", help="Discard an interrupted run and start over.")
+    parser.add_argument("--delete-old", action="store_true", help="Delete the previous collection after the swap.")
+    parser.add_argument("--settle-seconds", type=float, default=5, help="Seconds between pausing uploads and the final catch-up. Default is 5.")
+    args = parser.parse_args()
+
+    reindex_namespace(
+        args.namespace,
+        args.model,
+        page_size=args.page_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        restart=args.restart,
+        delete_old=args.delete_old,
+        settle_seconds=args.settle_seconds,
+    )
+
+
+if __name__ == "__main__":
+    main()
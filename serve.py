@@ -0,0 +1,239 @@
+"""
+Serve the API with a pool of recycled worker processes.
+
+Usage:
+    python serve.py --port 5000 --max-requests 500 --max-rss-mb 2048
+    CHROMA_SERVER_URL=http://127.0.0.1:8000 python serve.py --port 5000 --workers 4
+
+The supervisor opens the listening socket and starts the workers with the spawn start method; every worker
+accepts connections on the shared socket. A worker that has served --max-requests requests (plus a random
+jitter, so workers do not all restart together) or whose RSS passed --max-rss-mb stops accepting connections,
+tells the supervisor, waits for every connection it accepted to be closed and exits. SIGTERM or SIGINT drains
+every worker and stops.
+
+A Chroma PersistentClient keeps its HNSW index in process memory and never sees the writes of other processes,
+so by default there is a single worker, replaced once it has exited; connections wait in the listen backlog
+meanwhile. With CHROMA_SERVER_URL set, every worker talks to the Chroma server: several workers can run and a
+recycling worker is replaced right away, while the others keep accepting.
+"""
+import os
+import time
+import random
+import importlib
+import signal
+import socket
+import argparse
+import threading
+from multiprocessing import get_context
+
+from werkzeug.serving import ThreadedWSGIServer
+
+
+# longest wait before replacing a worker that keeps crashing
+MAX_RESTART_DELAY = 60
+
+
+class DrainingWSGIServer(ThreadedWSGIServer):
+    """
+    Threaded server counting its connections from accept to close, so a recycled worker waits for every one,
+    including a connection whose request is still being read, before it exits and kills the handler threads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+        self._condition = threading.Condition()
+
+    def process_request(self, request, client_address):
+        with self._condition:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        try:
+            super().shutdown_request(request)
+        finally:
+            with self._condition:
+                self.connections -= 1
+                self._condition.notify_all()
+
+    def wait_drained(self, timeout=None):
+        """
+        Wait until every accepted connection is closed.
+
+        Args:
+            timeout (float): Seconds to wait at most. Default is None, no limit.
+
+        Returns:
+            bool: True if drained, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.connections == 0, timeout=timeout)
+
+
+
+def _worker_main(sock, host, port, app_path, max_requests, max_rss_mb, drain_timeout, recycling, serving):
+    """
+    Run one worker: serve the app on the shared socket until it should be recycled, then drain and exit.
+    `serving` (multiprocessing.Event) is set once the app is loaded and the worker accepts connections,
+    `recycling` as soon as it stops accepting them.
+    """
+    from memoryMonitor import WorkerRecycler
+
+    module_name, app_name = app_path.split(":")
+    app = getattr(importlib.import_module(module_name), app_name)
+
+    server = DrainingWSGIServer(host, port, app, fd=sock.fileno())
+
+    def on_recycle(reason):
+        recycling.set()
+        # shutdown() blocks until serve_forever returns, so it cannot run on a request thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    recycler = WorkerRecycler(
+        app.wsgi_app,
+        max_requests=max_requests,
+        rss_limit_bytes=max_rss_mb * 2**20,
+        on_recycle=on_recycle,
+    )
+    app.wsgi_app = recycler
+    signal.signal(signal.SIGTERM, lambda signum, frame: recycler.recycle("SIGTERM"))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    print(f"Worker {os.getpid()} serving (max {max_requests or 'unlimited'} requests, max {max_rss_mb or 'unlimited'} MB RSS).")
+    serving.set()
+    server.serve_forever()
+    if not server.wait_drained(timeout=drain_timeout):
+        print(f"Worker {os.getpid()} exiting with {server.connections} connections still open after {drain_timeout}s.")
+    server.server_close()
+    print(f"Worker {os.getpid()} exited after {recycler.served} requests.")
+
+
+
+def serve(host, port, workers, max_requests=0, max_requests_jitter=0, max_rss_mb=0, drain_timeout=300, app_path="main:app"):
+    """
+    Start the workers and replace every worker that exits, until SIGTERM or SIGINT. With a Chroma server
+    (CHROMA_SERVER_URL), a worker is replaced as soon as it starts recycling.
+
+    A worker that crashes is replaced after a delay doubling with every consecutive crash, up to
+    MAX_RESTART_DELAY seconds. A worker that exits before serving, e.g. because the app fails to import,
+    stops every worker: its replacement would fail the same way.
+
+    Args:
+        host (str): Host to listen on.
+        port (int): Port to listen on.
+        workers (int): Number of worker processes.
+        max_requests (int): Requests after which a worker is recycled, 0 for no limit. Default is 0.
+        max_requests_jitter (int): Random extra requests per worker, so workers do not recycle together. Default is 0.
+        max_rss_mb (int): RSS in MB after which a worker is recycled, 0 for no limit. Default is 0.
+        drain_timeout (float): Seconds a recycled worker waits for its open connections. Default is 300.
+        app_path (str): Flask app to serve, as "module:attribute". Default is "main:app".
+
+    Raises:
+        ValueError: If several workers are asked for without a Chroma server.
+        RuntimeError: If a worker exited before serving.
+    """
+    shared_chroma = bool(os.environ.get("CHROMA_SERVER_URL"))
+    if workers > 1 and not shared_chroma:
+        raise ValueError("Several workers need a Chroma server: set CHROMA_SERVER_URL, or run a single worker.")
+
+    sock = socket.create_server((host, port), backlog=128)
+    context = get_context("spawn")
+    stopping = threading.Event()
+
+    def start_worker():
+        limit = max_requests + random.randint(0, max_requests_jitter) if max_requests else 0
+        recycling, serving = context.Event(), context.Event()
+        process = context.Process(
+            target=_worker_main, args=(sock, host, port, app_path, limit, max_rss_mb, drain_timeout, recycling, serving)
+        )
+        process.start()
+        return process, recycling, serving
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = [start_worker() for _ in range(workers)]
+    # recycled workers still finishing their connections
+    draining = []
+    # slot -> time.monotonic() at which its replacement starts, after a crash
+    restart_at = {}
+    restart_delay = 0
+    failure = None
+    print(f"Supervisor {os.getpid()} listening on http://{host}:{port} with {workers} workers.")
+    while not stopping.wait(0.5):
+        for i, worker in enumerate(processes):
+            if worker is None:
+                if time.monotonic() >= restart_at[i]:
+                    del restart_at[i]
+                    processes[i] = start_worker()
+                continue
+
+            process, recycling, serving = worker
+            if not process.is_alive():
+                process.join()
+                if not serving.is_set():
+                    failure = f"Worker {process.pid} exited with code {process.exitcode} before serving"
+                    stopping.set()
+                    break
+                # recycled workers exit with 0, back off from workers that keep crashing
+                restart_delay = 0 if process.exitcode == 0 else min(MAX_RESTART_DELAY, max(1, restart_delay * 2))
+                print(f"Worker {process.pid} exited with code {process.exitcode}, starting a replacement in {restart_delay}s.")
+                processes[i] = None
+                restart_at[i] = time.monotonic() + restart_delay
+            elif recycling.is_set() and shared_chroma:
+                print(f"Worker {process.pid} recycling, starting a replacement.")
+                draining.append(process)
+                processes[i] = start_worker()
+        for process in list(draining):
+            if not process.is_alive():
+                process.join()
+                draining.remove(process)
+                print(f"Recycled worker {process.pid} exited with code {process.exitcode}.")
+
+    print(f"{failure}, stopping." if failure else "Stopping: draining the workers.")
+    every_process = [worker[0] for worker in processes if worker is not None] + draining
+    for process in every_process:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    for process in every_process:
+        process.join()
+    sock.close()
+    if failure:
+        raise RuntimeError(failure)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with recycled worker processes.")
+    parser.add_argument("--app", default="main:app", help="Flask app to serve, as module:attribute. Default is main:app.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on. Default is 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on. Default is 5000.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", 1)),
+                        help="Worker processes, more than 1 needs CHROMA_SERVER_URL. Default is WEB_WORKERS or 1.")
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("WORKER_MAX_REQUESTS", 500)),
+                        help="Requests after which a worker is recycled, 0 for no limit. Default is WORKER_MAX_REQUESTS or 500.")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.environ.get("WORKER_MAX_REQUESTS_JITTER", 50)),
+                        help="Random extra requests per worker. Default is WORKER_MAX_REQUESTS_JITTER or 50.")
+    parser.add_argument("--max-rss-mb", type=int, default=int(os.environ.get("WORKER_MAX_RSS_MB", 0)),
+                        help="RSS in MB after which a worker is recycled, 0 for no limit. Default is WORKER_MAX_RSS_MB or 0.")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.environ.get("WORKER_DRAIN_TIMEOUT", 300)),
+                        help="Seconds a recycled worker waits for its open connections. Default is WORKER_DRAIN_TIMEOUT or 300.")
+    args = parser.parse_args()
+
+    try:
+        serve(
+            args.host, args.port, args.workers, args.max_requests, args.max_requests_jitter, args.max_rss_mb, args.drain_timeout,
+            app_path=args.app,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    except RuntimeError as e:
+        parser.exit(1, f"serve.py: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,81 @@
 import os
+import re
+import heapq
+import asyncio
+import subprocess
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pytesseract
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 import openai
-from pdf2image import convert_from_path
+import fitz  # PyMuPDF
 import json
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from vectorStore import VectorStore 
+from lexicalIndex import LexicalIndex
+from profileStore import ProfileStore
+from queryCache import LRUCache, WriteGenerations
+from deadline import DeadlineExceeded
 from datetime import datetime
+from urllib.parse import urlparse
 
 import chromadb
+from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
             
-storage_path = './chroma_db/'
-print(storage_path)
 load_dotenv('.env.local')
+storage_path = os.environ.get('STORAGE_PATH', './chroma_db/')
+print(storage_path)
 if storage_path is None:
     raise ValueError('STORAGE_PATH environment variable is not set')
-client = chromadb.PersistentClient(path= storage_path)
-collection = client.get_or_create_collection(name="test")
+# A PersistentClient keeps the HNSW index of each collection in process memory and never sees the writes of
+# other processes, so several processes (serve.py workers, reindex.py next to the service) need a Chroma server.
+CHROMA_SERVER_URL = os.environ.get("CHROMA_SERVER_URL")
+if CHROMA_SERVER_URL:
+    chroma_server = urlparse(CHROMA_SERVER_URL)
+    client = chromadb.HttpClient(
+        host=chroma_server.hostname,
+        port=chroma_server.port or (443 if chroma_server.scheme == "https" else 8000),
+        ssl=chroma_server.scheme == "https",
+    )
+else:
+    client = chromadb.PersistentClient(path= storage_path)
+
+# Candidates are partitioned into one Chroma collection (shard) per namespace, e.g. a tenant,
+# a region or a hiring pipeline. The registry maps each namespace to its collection name;
+# "test" is the original single collection and stays the default shard.
+DEFAULT_NAMESPACE = "test"
+shard_registry_path = os.path.join(storage_path, "shards.json")
+# registry key listing the namespaces whose uploads are paused, e.g. while reindex.py swaps them;
+# it cannot clash with a namespace, which starts with a letter or a digit
+PAUSED_KEY = "_paused"
+_shard_registry = {"mtime": None, "shards": {DEFAULT_NAMESPACE: DEFAULT_NAMESPACE}, "paused": set()}
+_shard_collections = {}
+_shard_lock = threading.Lock()
+_embedding_functions = {}
+
+# fan-out pool for multi-namespace queries
+shard_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SHARD_QUERY_WORKERS", 8)))
+
+# BM25 index over skills, technologies and inference text for keyword queries
+lexical_index = LexicalIndex(os.path.join(storage_path, "lexical_index.sqlite3"))
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+# hybrid mode: lexical candidates per requested result, and the reciprocal rank fusion constant
+HYBRID_CANDIDATE_FACTOR = 5
+RRF_K = 60
+
+# full candidate profiles (extracted info, inference, metadata) returned by retrieval
+profile_store = ProfileStore(os.path.join(storage_path, "profiles.sqlite3"))
+
+# top-k results, keyed by normalized query, top_k, namespaces and mode, are valid until their namespaces are written to.
+# query embeddings are cached separately, so repeated queries skip the model even after new uploads.
+write_generations = WriteGenerations(os.path.join(storage_path, "generations.sqlite3"))
+result_cache = LRUCache(maxsize=int(os.environ.get("RESULT_CACHE_SIZE", 1024)))
+query_embedding_cache = LRUCache(maxsize=int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 4096)))
 
 
 
@@ -36,31 +92,346 @@ if not openai_api_key:
 openai.api_key = openai_api_key
 
 
-def extract_text_from_pdf(pdf_path):
+
+def normalize_namespace(namespace):
+    """
+    Normalize a namespace the same way as `VectorStore.create_namespace` and validate it as a Chroma collection name.
+
+    Args:
+        namespace (str): Namespace such as a tenant, region or hiring pipeline. Empty means the default namespace.
+
+    Returns:
+        str: The normalized namespace.
+
+    Raises:
+        ValueError: If the namespace cannot be used as a collection name.
+    """
+    if not namespace:
+        return DEFAULT_NAMESPACE
+    namespace = str(namespace).strip().replace(" ", "_").lower()
+    if not re.fullmatch(r"[a-z0-9][a-z0-9_-]{1,61}[a-z0-9]", namespace):
+        raise ValueError(f"Invalid namespace: {namespace!r} (3-63 characters of a-z, 0-9, '_' or '-')")
+    return namespace
+
+
+
+def _load_shard_registry():
+    """
+    Load the namespace -> collection registry, re-reading the file only when another worker changed it.
+
+    Returns:
+        dict: Mapping of namespace to Chroma collection name.
+    """
+    try:
+        mtime = os.stat(shard_registry_path).st_mtime_ns
+    except FileNotFoundError:
+        return _shard_registry["shards"]
+
+    if mtime != _shard_registry["mtime"]:
+        with open(shard_registry_path) as f:
+            shards = json.load(f)
+        paused = set(shards.pop(PAUSED_KEY, []))
+        shards.setdefault(DEFAULT_NAMESPACE, DEFAULT_NAMESPACE)
+        _shard_registry.update(mtime=mtime, shards=shards, paused=paused)
+    return _shard_registry["shards"]
+
+
+
+def _update_shard_registry(namespace, collection_name=None, paused=None):
+    """
+    Point a namespace at a collection and/or pause its uploads. The registry file is replaced atomically
+    so readers never see a partial write.
+
+    Args:
+        namespace (str): Normalized namespace.
+        collection_name (str): Name of the Chroma collection serving the namespace. Default is None, unchanged.
+        paused (bool): Whether the uploads to the namespace are paused. Default is None, unchanged.
+    """
+    with open(shard_registry_path + ".lock", "w") as lock_file:
+        # other worker processes may register shards concurrently
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        shards = dict(_load_shard_registry())
+        paused_namespaces = set(_shard_registry["paused"])
+        if collection_name is not None:
+            shards[namespace] = collection_name
+        if paused is True:
+            paused_namespaces.add(namespace)
+        elif paused is False:
+            paused_namespaces.discard(namespace)
+        if paused_namespaces:
+            shards[PAUSED_KEY] = sorted(paused_namespaces)
+        tmp_path = f"{shard_registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(shards, f, indent=2)
+        os.replace(tmp_path, shard_registry_path)
+
+
+
+class UploadsPaused(Exception):
+    """
+    Raised by an upload to a namespace whose uploads are paused.
+    """
+
+
+
+def pause_uploads(namespace, paused=True):
+    """
+    Pause or resume the uploads to a namespace, in every worker. A paused upload raises UploadsPaused,
+    answered with a 503 so the client retries.
+
+    Args:
+        namespace (str): Namespace of the shard.
+        paused (bool): True to pause the uploads, False to resume them. Default is True.
+    """
+    namespace = normalize_namespace(namespace)
+    with _shard_lock:
+        _update_shard_registry(namespace, paused=paused)
+    print(f"Uploads to namespace {namespace} {'paused' if paused else 'resumed'}.")
+
+
+
+def uploads_paused(namespace):
+    """
+    Returns:
+        bool: Whether the uploads to the namespace are paused.
+    """
+    with _shard_lock:
+        _load_shard_registry()
+        return normalize_namespace(namespace) in _shard_registry["paused"]
+
+
+
+def swap_shard(namespace, collection_name):
+    """
+    Atomically point a namespace at another collection, e.g. after it was re-indexed with a new embedding model,
+    and resume its uploads if they were paused.
+
+    Args:
+        namespace (str): Namespace of the shard.
+        collection_name (str): Name of the collection that now serves the namespace.
+
+    Returns:
+        str: Name of the collection that served the namespace before the swap, or None.
+    """
+    namespace = normalize_namespace(namespace)
+    with _shard_lock:
+        previous = _load_shard_registry().get(namespace)
+        _update_shard_registry(namespace, collection_name, paused=False)
+        _shard_collections.pop(collection_name, None)
+    write_generations.bump(namespace)
+    print(f"Namespace {namespace} now served by collection {collection_name} (was {previous}).")
+    return previous
+
+
+
+def list_namespaces():
+    """
+    List the namespaces that currently have a shard.
+
+    Returns:
+        list: Namespace names.
+    """
+    return list(_load_shard_registry())
+
+
+
+def get_shard(namespace=DEFAULT_NAMESPACE, create=False):
+    """
+    Get the Chroma collection holding the candidates of a namespace.
+
+    Args:
+        namespace (str): Namespace of the shard.
+        create (bool): Whether to create the shard if it does not exist yet. Default is False.
+
+    Returns:
+        chromadb.Collection: The shard collection, or None if it does not exist and `create` is False.
+    """
+    namespace = normalize_namespace(namespace)
+    with _shard_lock:
+        collection_name = _load_shard_registry().get(namespace)
+        if collection_name is None:
+            if not create:
+                return None
+            collection_name = namespace
+            _update_shard_registry(namespace, collection_name)
+            print(f"Shard created for namespace {namespace}.")
+
+        shard = _shard_collections.get(collection_name)
+        if shard is None:
+            shard = _open_collection(collection_name)
+            _shard_collections[collection_name] = shard
+        return shard
+
+
+
+def get_embedding_function(model_name=None):
+    """
+    Get the (cached) sentence-transformers embedding function for a model.
+
+    Args:
+        model_name (str): Name of the sentence-transformers model, e.g. "all-MiniLM-L6-v2". Default is None, Chroma's default embedding function.
+
+    Returns:
+        EmbeddingFunction: Embedding function usable by Chroma collections.
+    """
+    if model_name not in _embedding_functions:
+        if model_name is None:
+            _embedding_functions[model_name] = embedding_functions.DefaultEmbeddingFunction()
+        else:
+            _embedding_functions[model_name] = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+    return _embedding_functions[model_name]
+
+
+
+def _open_collection(collection_name):
+    """
+    Open a Chroma collection with the embedding model it was indexed with.
+
+    Collections built by `reindex.py` record their model in the "embedding_model" metadata key,
+    so queries and upserts keep using the same model. Other collections use Chroma's default.
+
+    Args:
+        collection_name (str): Name of the collection.
+
+    Returns:
+        chromadb.Collection: The collection.
+    """
+    try:
+        # get_or_create_collection would overwrite the metadata of an existing collection
+        collection = client.get_collection(name=collection_name)
+    except ValueError:
+        collection = client.get_or_create_collection(name=collection_name, metadata={"hnsw:space": "cosine"})
+
+    model_name = (collection.metadata or {}).get("embedding_model")
+    if model_name:
+        collection = client.get_collection(name=collection_name, embedding_function=get_embedding_function(model_name))
+    return collection
+
+
+def _ocr_image(image_bytes, timeout=None):
+    """
+    Run Tesseract OCR on an in-memory image. The image is piped to the tesseract binary, whereas
+    pytesseract.image_to_string always writes the image to a temporary file first.
+
+    Args:
+        image_bytes (bytes): Image in a format Tesseract reads, e.g. PPM.
+        timeout (float): Seconds after which Tesseract is killed. Default is None, no limit.
+
+    Returns:
+        str: Recognized text.
+
+    Raises:
+        RuntimeError: If Tesseract fails.
+        DeadlineExceeded: If Tesseract did not finish within the timeout.
+    """
+    try:
+        result = subprocess.run(
+            [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout"],
+            input=image_bytes,
+            capture_output=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise DeadlineExceeded(f"Deadline exceeded during OCR ({timeout:.1f}s left)")
+    if result.returncode != 0:
+        raise RuntimeError(f"Tesseract OCR failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+
+class InvalidPDFError(ValueError):
+    """
+    Raised when PyMuPDF cannot open the uploaded file.
+    """
+
+
+
+def extract_text_from_pdf(pdf, dpi=200, deadline=None):
     """
-    Extract text from a PDF file using OCR.
+    Extract text from a PDF file using OCR. Pages are rasterized and passed to OCR in memory, without temporary files.
 
     Args:
-        pdf_path (str): Path to the PDF file.
+        pdf (bytes or str): Content of the PDF file, or path to the PDF file.
+        dpi (int): Rasterization resolution. Default is 200.
+        deadline (Deadline): Request deadline, checked before every page and bounding the OCR. Default is None.
 
     Returns:
         str: Extracted text from the PDF.
+
+    Raises:
+        InvalidPDFError: If the file is not a readable PDF.
     """
-    images = convert_from_path(pdf_path)
+    try:
+        document = fitz.open(stream=pdf, filetype="pdf") if isinstance(pdf, (bytes, bytearray)) else fitz.open(pdf)
+    except fitz.FileDataError as e:
+        raise InvalidPDFError(f"The uploaded file is not a valid PDF: {e}") from e
     resume_content = ""
-    for image in images:
-        resume_content += pytesseract.image_to_string(image)
+    with document:
+        for page in document:
+            if deadline is not None:
+                deadline.check(f"OCR of page {page.number + 1}")
+            pixmap = page.get_pixmap(dpi=dpi)
+            resume_content += _ocr_image(pixmap.tobytes("ppm"), timeout=deadline.remaining() if deadline else None)
     return resume_content
 
 
 
 
-def extract_personal_info(resume_text):
+def _llm(deadline=None):
+    """
+    Create the chat model, with a request timeout bounded by the deadline.
+    """
+    return ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key, timeout=deadline.remaining() if deadline else None)
+
+
+
+async def _arun_until(chain, inputs, deadline, poll_interval=0.1):
+    """
+    Run an LLM chain asynchronously, cancelling it once the deadline passes or the request is cancelled.
+    """
+    task = asyncio.ensure_future(chain.arun(inputs))
+    while not task.done():
+        if deadline.cancelled or deadline.expired:
+            # closes the HTTP request to the LLM instead of waiting for an answer nobody will read
+            task.cancel()
+            deadline.check("the end of the LLM call")
+        await asyncio.wait({task}, timeout=poll_interval)
+    return task.result()
+
+
+
+def _run_chain(chain, inputs, deadline=None):
+    """
+    Run an LLM chain. With a deadline, the call is skipped if the deadline already passed, and cancelled
+    in flight once the deadline passes or the request is cancelled.
+
+    Args:
+        chain (LLMChain): The chain to run.
+        inputs (dict): Inputs of the chain.
+        deadline (Deadline): Request deadline. Default is None.
+
+    Returns:
+        str: Output of the chain.
+
+    Raises:
+        DeadlineExceeded: If the deadline passes before the call completes.
+        RequestCancelled: If the request is cancelled before the call completes.
+    """
+    if deadline is None:
+        return chain.run(inputs)
+    deadline.check("LLM call")
+    return asyncio.run(_arun_until(chain, inputs, deadline))
+
+
+
+
+def extract_personal_info(resume_text, deadline=None):
     """
     Extract personal information from the resume text using a language model.
 
     Args:
         resume_text (str): Text content of the resume.
+        deadline (Deadline): Request deadline. Default is None.
 
     Returns:
         str: Extracted personal information in JSON format.
@@ -82,21 +453,22 @@ def extract_personal_info(resume_text):
         """,
         input_variables=["resume_text"],
     )
-    llm = ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key)
+    llm = _llm(deadline)
     chain = LLMChain(llm=llm, prompt=prompt)
-    result = chain.run({"resume_text": resume_text})
+    result = _run_chain(chain, {"resume_text": resume_text}, deadline)
     return result
 
 
 
 
 
-def extract_education(resume_text):
+def extract_education(resume_text, deadline=None):
     """
     Extract education details from the resume text using a language model.
 
     Args:
         resume_text (str): Text content of the resume.
+        deadline (Deadline): Request deadline. Default is None.
 
     Returns:
         str: Extracted education details in JSON format.
@@ -120,20 +492,21 @@ def extract_education(resume_text):
         """,
         input_variables=["resume_text"],
     )
-    llm = ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key)
+    llm = _llm(deadline)
     chain = LLMChain(llm=llm, prompt=prompt)
-    result = chain.run({"resume_text": resume_text})
+    result = _run_chain(chain, {"resume_text": resume_text}, deadline)
     return result
 
 
 
 
-def extract_work_experience(resume_text):
+def extract_work_experience(resume_text, deadline=None):
     """
     Extract work experience details from the resume text using a language model.
 
     Args:
         resume_text (str): Text content of the resume.
+        deadline (Deadline): Request deadline. Default is None.
 
     Returns:
         str: Extracted work experience details in JSON format.
@@ -156,21 +529,22 @@ def extract_work_experience(resume_text):
         """,
         input_variables=["resume_text"],
     )
-    llm = ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key)
+    llm = _llm(deadline)
     chain = LLMChain(llm=llm, prompt=prompt)
-    result = chain.run({"resume_text": resume_text})
+    result = _run_chain(chain, {"resume_text": resume_text}, deadline)
     return result
 
 
 
 
 
-def extract_projects_and_skills(resume_text):
+def extract_projects_and_skills(resume_text, deadline=None):
     """
     Extract project experience and skills from the resume text using a language model.
 
     Args:
         resume_text (str): Text content of the resume.
+        deadline (Deadline): Request deadline. Default is None.
 
     Returns:
         str: Extracted project experience and skills in JSON format.
@@ -203,9 +577,9 @@ def extract_projects_and_skills(resume_text):
         """,
         input_variables=["resume_text"],
     )
-    llm = ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key)
+    llm = _llm(deadline)
     chain = LLMChain(llm=llm, prompt=prompt)
-    result = chain.run({"resume_text": resume_text})
+    result = _run_chain(chain, {"resume_text": resume_text}, deadline)
     print(result)
     return result
 
@@ -213,19 +587,20 @@ def extract_projects_and_skills(resume_text):
 
 
 
-def generate_inference(extracted_info):
+def generate_inference(extracted_info, deadline=None):
     """
     Generate a summary of the resume based on extracted information using a language model.
 
     Args:
         extracted_info (str): Extracted information from the resume in JSON format.
+        deadline (Deadline): Request deadline. Default is None.
 
     Returns:
         str: Generated summary of the resume in JSON format.
     """
     
     
-    llm = ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key)
+    llm = _llm(deadline)
 
     prompt = PromptTemplate(
         template="""
@@ -243,29 +618,67 @@ def generate_inference(extracted_info):
     )
 
     chain = LLMChain(llm=llm, prompt=prompt)
-    inference = chain.run({"extracted_info": extracted_info})
+    inference = _run_chain(chain, {"extracted_info": extracted_info}, deadline)
     
     return inference
 
 
 
-def extract_and_infer(pdf_path):
+def _as_list(value):
+    """
+    Normalize a section of the LLM output to a list; sections are sometimes wrapped in a single-key object.
+    """
+    if isinstance(value, dict) and len(value) == 1:
+        value = next(iter(value.values()))
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+
+def _collect_technologies(extracted_info_json):
+    """
+    Collect the technologies used in projects and the skills involved in work experience.
+
+    Args:
+        extracted_info_json (dict): Extracted information of the resume.
+
+    Returns:
+        list: Technology and skill strings.
+    """
+    projects = _as_list(extracted_info_json.get("projects_and_skills", {}).get("Project Experience", []))
+    work_experience = _as_list(extracted_info_json.get("work_experience", []))
+    technologies = [project.get("technologies_used") for project in projects if isinstance(project, dict)]
+    technologies += [work.get("skills involved") for work in work_experience if isinstance(work, dict)]
+    return [str(technology) for technology in technologies if technology]
+
+
+
+def extract_and_infer(pdf, namespace=DEFAULT_NAMESPACE, deadline=None):
     """
     Extract text from a PDF, extract information from the text, generate a summary, and store embeddings in ChromaDB.
 
     Args:
-        pdf_path (str): Path to the PDF file.
+        pdf (bytes or str): Content of the PDF file, or path to the PDF file.
+        namespace (str): Namespace (shard) the candidate is stored in. Default is DEFAULT_NAMESPACE.
+        deadline (Deadline): Request deadline, passed through OCR, every LLM call and the upsert. Default is None.
 
     Returns:
         tuple: Extracted information and generated summary.
+
+    Raises:
+        UploadsPaused: If the uploads to the namespace are paused.
     """
+    # fail fast, before the OCR and LLM calls; checked again before the upsert
+    if uploads_paused(namespace):
+        raise UploadsPaused(f"Uploads to namespace {namespace} are paused, retry later")
     
-    resume_text = extract_text_from_pdf(pdf_path)
+    resume_text = extract_text_from_pdf(pdf, deadline=deadline)
     
-    personal_info = extract_personal_info(resume_text)
-    education = extract_education(resume_text)
-    work_experience = extract_work_experience(resume_text)
-    projects_and_skills = extract_projects_and_skills(resume_text)
+    personal_info = extract_personal_info(resume_text, deadline=deadline)
+    education = extract_education(resume_text, deadline=deadline)
+    work_experience = extract_work_experience(resume_text, deadline=deadline)
+    projects_and_skills = extract_projects_and_skills(resume_text, deadline=deadline)
     
     # convert to dict
     extracted_info_json = {
@@ -275,17 +688,17 @@ def extract_and_infer(pdf_path):
         "projects_and_skills": json.loads(projects_and_skills),
     }
     
-    inference = generate_inference(json.dumps(extracted_info_json))
+    inference = generate_inference(json.dumps(extracted_info_json), deadline=deadline)
     inference_json = json.loads(inference)
 
     # Collecting data for the collection
     inferences = inference_json.get('inference')
     name = extracted_info_json.get('personal_information').get('name', 'Unknown Name')
     
-    skills = extracted_info_json.get('projects_and_skills').get('Skills', [])
+    skills = [str(skill) for skill in _as_list(extracted_info_json.get('projects_and_skills').get('Skills', []))]
     current_timestamp = datetime.now().isoformat()
     metadatas = [
-        {"source": "inference", "timestamp": current_timestamp, "author": "admin_test"},
+        {"source": "inference", "timestamp": current_timestamp, "author": "admin_test", "namespace": namespace},
     ]
     
     # Adding the documents to the collection
@@ -294,12 +707,22 @@ def extract_and_infer(pdf_path):
     print("Metadatas:", metadatas)
     print("IDs:", name)
     
-    collection.upsert(
+    # past the deadline, the client has given up: do not store a candidate it never saw
+    if deadline is not None:
+        deadline.check("upsert")
+    if uploads_paused(namespace):
+        raise UploadsPaused(f"Uploads to namespace {namespace} are paused, retry later")
+    shard = get_shard(namespace, create=True)
+    shard.upsert(
         documents=[inferences],
         metadatas=metadatas,
         ids=[name]
     )
-    print("Background correctly added to the collection.")
+    profile_store.upsert(namespace, name, extracted_info_json, inference_json, metadatas[0])
+    lexical_index.upsert(namespace, name, skills=skills, technologies=_collect_technologies(extracted_info_json), inference=inferences)
+    # invalidates the cached results of this namespace, in every worker
+    write_generations.bump(namespace)
+    print(f"Background correctly added to the {namespace} shard.")
 
     return extracted_info_json, inference_json
 
@@ -307,43 +730,285 @@ def extract_and_infer(pdf_path):
 
 
 
-def retrieve_top_documents(query = "", top_k=5): # query should be the inference of the current selected user 
-    # example query: "The candidate has a strong background in software engineering and has worked on multiple projects using Python and Java."
+def normalize_query(query):
+    """
+    Collapse whitespace so that trivially different spellings of a query share cache entries.
     """
-    Retrieve the top documents that best fit the provided query using embeddings.
+    return " ".join(str(query).split())
+
+
+
+def embed_query(query, model_name=None):
+    """
+    Embed a query, reusing the embedding of a previous identical query.
+
+    Args:
+        query (str): Normalized query text.
+        model_name (str): Embedding model of the shard, None for Chroma's default.
+
+    Returns:
+        list: The query embedding.
+    """
+    key = (model_name, query)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = get_embedding_function(model_name)([query])[0]
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+
+def _query_shard(namespace, query, top_k):
+    """
+    Query a single namespace shard.
 
     Args:
+        namespace (str): Namespace of the shard.
         query (str): Query text.
-        top_k (int): Number of top documents to retrieve. Default is 5.
+        top_k (int): Number of top documents to retrieve.
 
     Returns:
-        list: List of top documents with their scores, extracted information, and summaries.
+        dict: Chroma query result for the shard, empty if the shard does not exist or holds no documents.
     """
+    shard = get_shard(namespace)
+    count = shard.count() if shard is not None else 0
+    if count == 0:
+        return {"ids": [[]], "distances": [[]], "metadatas": [[]], "documents": [[]]}
+
+    model_name = (shard.metadata or {}).get("embedding_model")
+    return shard.query(
+        query_embeddings=[embed_query(query, model_name)],
+        n_results=min(top_k, count),
+        include=["metadatas", "documents", "distances"],
+    )
 
-    #generate embedding for the query
-    # query_embedding = model.encode(query).tolist()
-    
-    # # Search
-    # results = vector_store.pinecone_index.query(
-    #     vector=query_embedding,
-    #     top_k=top_k,
-    #     include_metadata=True,
-    #     namespace=vector_store.namespace
-    # )
-    
-    # top_documents = []
-    # for match in results['matches']:
-    #     top_documents.append({
-    #         "score": match['score'],
-    #         "extracted_info": match['metadata'],
-    #         "summary": match['metadata'].get('summary')
-    #     })
-    
-    res = collection.query(
-        query_texts=query,
-        n_results=top_k,
+
+
+def _fetch_shard_records(namespace, ids, query=None):
+    """
+    Fetch documents of a shard by ID, optionally with their cosine distance to a query.
+
+    Args:
+        namespace (str): Namespace of the shard.
+        ids (list): Document IDs.
+        query (str): Query text to compute distances for. Default is None.
+
+    Returns:
+        dict: ID -> {"document", "metadata", "distance"}, with "distance" only when a query is given.
+    """
+    shard = get_shard(namespace)
+    if shard is None or not ids:
+        return {}
+
+    include = ["documents", "metadatas"] + (["embeddings"] if query is not None else [])
+    res = shard.get(ids=ids, include=include)
+    records = {
+        doc_id: {"document": document, "metadata": metadata}
+        for doc_id, document, metadata in zip(res["ids"], res["documents"], res["metadatas"])
+    }
+
+    if query is not None and res["ids"]:
+        # dense scoring over the candidate set only, with the model the shard was indexed with
+        model_name = (shard.metadata or {}).get("embedding_model")
+        query_embedding = np.asarray(embed_query(query, model_name))
+        embeddings = np.asarray(res["embeddings"])
+        similarities = embeddings @ query_embedding / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding) + 1e-12
+        )
+        for doc_id, similarity in zip(res["ids"], similarities):
+            records[doc_id]["distance"] = float(1 - similarity)
+    return records
+
+
+
+def _dense_search(query, top_k, namespaces):
+    """
+    Search the dense index. A single namespace only touches its own shard, several namespaces are queried
+    in parallel and the per-shard top-k lists are merged by distance with a heap.
+    """
+    if len(namespaces) == 1:
+        res = _query_shard(namespaces[0], query, top_k)
+        res["namespaces"] = [[namespaces[0]] * len(res["ids"][0])]
+        return res
+
+    # fan out over the shards, then merge the per-shard top-k
+    shard_results = shard_executor.map(lambda namespace: (namespace, _query_shard(namespace, query, top_k)), namespaces)
+    matches = (
+        (distance, namespace, doc_id, metadata, document)
+        for namespace, res in shard_results
+        for doc_id, distance, metadata, document in zip(
+            res["ids"][0], res["distances"][0], res["metadatas"][0], res["documents"][0]
+        )
     )
-    
-    
-    
+    top_matches = heapq.nsmallest(top_k, matches, key=lambda match: match[0])
+
+    return {
+        "ids": [[match[2] for match in top_matches]],
+        "distances": [[match[0] for match in top_matches]],
+        "metadatas": [[match[3] for match in top_matches]],
+        "documents": [[match[4] for match in top_matches]],
+        "namespaces": [[match[1] for match in top_matches]],
+    }
+
+
+
+def _ranked_result(ranked, records):
+    """
+    Build a Chroma-style result from (score, namespace, doc_id) tuples, best first.
+    """
+    ranked = [match for match in ranked if match[2] in records.get(match[1], {})]
+    return {
+        "ids": [[doc_id for _, _, doc_id in ranked]],
+        "scores": [[score for score, _, _ in ranked]],
+        "metadatas": [[records[namespace][doc_id]["metadata"] for _, namespace, doc_id in ranked]],
+        "documents": [[records[namespace][doc_id]["document"] for _, namespace, doc_id in ranked]],
+        "namespaces": [[namespace for _, namespace, _ in ranked]],
+    }
+
+
+
+def _group_by_namespace(matches):
+    """
+    Group (namespace, doc_id, score) matches into namespace -> [doc_id].
+    """
+    grouped = {}
+    for namespace, doc_id, _ in matches:
+        grouped.setdefault(namespace, []).append(doc_id)
+    return grouped
+
+
+
+def _lexical_search(query, top_k, namespaces):
+    """
+    Rank candidates with the BM25 index only; the embedding model is never called.
+    """
+    matches = lexical_index.search(query, namespaces, top_k=top_k)
+    records = {
+        namespace: _fetch_shard_records(namespace, ids)
+        for namespace, ids in _group_by_namespace(matches).items()
+    }
+    return _ranked_result([(score, namespace, doc_id) for namespace, doc_id, score in matches], records)
+
+
+
+def _hybrid_search(query, top_k, namespaces):
+    """
+    Take the BM25 candidates, score only those against the query embedding and fuse both rankings
+    with reciprocal rank fusion. Falls back to dense search when no keyword matches, scored by reciprocal
+    rank too so the result has the same shape.
+    """
+    matches = lexical_index.search(query, namespaces, top_k=top_k * HYBRID_CANDIDATE_FACTOR)
+    if not matches:
+        res = _dense_search(query, top_k, namespaces)
+        res["scores"] = [[1 / (RRF_K + rank) for rank in range(1, len(res["ids"][0]) + 1)]]
+        del res["distances"]
+        return res
+
+    grouped = _group_by_namespace(matches)
+    records = dict(zip(grouped, shard_executor.map(
+        lambda namespace: _fetch_shard_records(namespace, grouped[namespace], query=query), grouped
+    )))
+
+    dense_ranking = sorted(
+        ((record["distance"], namespace, doc_id) for namespace in records for doc_id, record in records[namespace].items()),
+        key=lambda match: match[0],
+    )
+    fused = {}
+    for rank, (namespace, doc_id, _) in enumerate(matches, start=1):
+        fused[(namespace, doc_id)] = 1 / (RRF_K + rank)
+    for rank, (_, namespace, doc_id) in enumerate(dense_ranking, start=1):
+        fused[(namespace, doc_id)] = fused.get((namespace, doc_id), 0) + 1 / (RRF_K + rank)
+
+    top_matches = heapq.nlargest(top_k, ((score, *key) for key, score in fused.items()), key=lambda match: match[0])
+    return _ranked_result(top_matches, records)
+
+
+
+def retrieve_top_documents(query = "", top_k=5, namespaces=None, mode="dense"): # query should be the inference of the current selected user 
+    # example query: "The candidate has a strong background in software engineering and has worked on multiple projects using Python and Java."
+    """
+    Retrieve the top documents that best fit the provided query. Results are cached until one of the
+    searched namespaces is written to; the returned dict may be shared with other callers and must not be modified.
+
+    Args:
+        query (str): Query text.
+        top_k (int): Number of top documents to retrieve. Default is 5.
+        namespaces (str or list): Namespace(s) to search. Default is None, which searches every shard.
+        mode (str): "dense" (embeddings), "lexical" (BM25 over skills, technologies and inference, for keyword
+            queries) or "hybrid" (dense scoring of the lexical candidates, fused with reciprocal rank fusion). Default is "dense".
+
+    Returns:
+        dict: Chroma-style result (ids, metadatas, documents) with the namespace and stored profile
+            (extracted_info, inference, metadata; None if unknown) of every match, and "distances" in
+            dense mode or "scores" (higher is better) in lexical and hybrid modes.
+
+    Raises:
+        ValueError: If the mode or a namespace is invalid.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Invalid mode: {mode!r}, expected one of {', '.join(RETRIEVAL_MODES)}")
+
+    if namespaces is None:
+        namespaces = list_namespaces()
+    elif isinstance(namespaces, str):
+        namespaces = [namespaces]
+    namespaces = sorted(set(normalize_namespace(namespace) for namespace in namespaces))
+    query = normalize_query(query)
+
+    # the generations are read before searching: a write landing mid-search makes the entry stale, not wrong
+    cache_key = (query, top_k, tuple(namespaces), mode)
+    generations = write_generations.current(namespaces)
+    cached = result_cache.get(cache_key)
+    if cached is not None and cached[0] == generations:
+        return cached[1]
+
+    if mode == "lexical":
+        res = _lexical_search(query, top_k, namespaces)
+    elif mode == "hybrid":
+        res = _hybrid_search(query, top_k, namespaces)
+    else:
+        res = _dense_search(query, top_k, namespaces)
+
+    # one bulk lookup for the structured profiles of all matches
+    keys = list(zip(res["namespaces"][0], res["ids"][0]))
+    profiles = profile_store.get_many(keys)
+    res["profiles"] = [[profiles.get(key) for key in keys]]
+
+    result_cache.put(cache_key, (generations, res))
     return res
+
+
+
+def backfill_lexical_index(namespaces=None, page_size=1000):
+    """
+    Add the candidates stored before the lexical index existed to it. Only their inference text is
+    known, since the extracted skills were never persisted.
+
+    Args:
+        namespaces (list): Namespaces to backfill. Default is None, every shard.
+        page_size (int): Number of documents read per page. Default is 1000.
+
+    Returns:
+        int: Number of candidates added.
+    """
+    added = 0
+    for namespace in namespaces or list_namespaces():
+        shard = get_shard(namespace)
+        namespace_added = 0
+        offset = 0
+        while shard is not None:
+            page = shard.get(offset=offset, limit=page_size, include=["documents"])
+            if not page["ids"]:
+                break
+            indexed = lexical_index.contains(namespace, page["ids"])
+            for doc_id, document in zip(page["ids"], page["documents"]):
+                if doc_id not in indexed:
+                    lexical_index.upsert(namespace, doc_id, inference=document)
+                    namespace_added += 1
+            offset += len(page["ids"])
+        if namespace_added:
+            # cached lexical and hybrid results of this namespace miss the backfilled candidates
+            write_generations.bump(namespace)
+        added += namespace_added
+    print(f"Added {added} candidates to the lexical index.")
+    return added